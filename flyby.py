@@ -3,155 +3,250 @@
 
    :synopsis: Function that uses NASA public HTTP APIs for predicting next time a satellite image will be taken
 """
-import requests
-import json
-import re
 import traceback
-import sys
-from datetime import datetime, timedelta
+import time
 import argparse
 import os
-import unittest
-from dotenv import load_dotenv, find_dotenv
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
+import threading
+import concurrent.futures
+
+ASSETS_URL = 'https://api.nasa.gov/planetary/earth/assets'
+
+# third-party imports (requests alone is ~50-100 ms of startup) are
+# deferred until a lookup actually happens, so 'python flyby.py -h' and
+# the bad-arguments path return without paying for them
+
+# shared session so repeated calls reuse the pooled HTTPS connection
+# instead of paying a TCP/TLS handshake per request; transient failures
+# and gateway errors are retried with backoff instead of surfacing a
+# traceback on the first blip
+_SESSION = None
+_SESSION_LOCK = threading.Lock() # flyby_many workers race on first use
+
+def _get_session():
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                import requests
+                import urllib3
+                retries = urllib3.util.Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+                session = requests.Session()
+                session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=16, max_retries=retries))
+                _SESSION = session
+    return _SESSION
+
+# on-disk cache of decoded JSON payloads; the assets endpoint returns
+# stable historical data, so repeated queries for the same coordinates
+# can skip the network entirely
+_CACHE = None
+_CACHE_TTL = 24 * 60 * 60 # seconds
+_CACHE_LOCK = threading.Lock()
+
+def _get_cache():
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                import diskcache
+                _CACHE = diskcache.Cache(os.path.expanduser('~/.flyby-cache'))
+    return _CACHE
+
+# in-process cache of the same payloads, so hot coordinates queried
+# repeatedly within one run skip even the disk/JSON round trip
+_MEM_CACHE = {} # cache_key -> (monotonic timestamp, json_data)
+_MEM_CACHE_TTL = 30 # seconds
+
+
+def _compute_next_time(json_data, err):
+    """
+    helper to validate a NASA JSON payload and calculate the predicted next image time
+
+    :param json_data: Decoded JSON payload from the NASA API
+    :param err: Callable building an error message from a detail string
+    :return: Predicted datetime, or None if the payload was invalid
+    """
+    import numpy as np
+
+    if 'count' not in json_data: # check that the JSON data has a count key
+        print(err("did not contain 'count' key in JSON"))
+        return None
+
+    try:
+        count = int(json_data['count'])
+    except: # check that count key in JSON data is an integer
+        print(err("did not contain an integer for 'count' value in JSON"))
+        return None
+
+    if count == 0: # print error message if count is 0
+        print(err("had 0 count in JSON payload, could not calculate avg_time_delta"))
+        return None
+
+    # print error message if no results array found in JSON
+    if 'results' not in json_data:
+        print(err("did not contain 'results' key in JSON"))
+
+
+    results = json_data['results']
+    results_count = len(results)
+    if results_count != count: # check that number of results match the count in JSON payload
+        print(err("count of {0}, did not match number of results {1}".format(count, results_count)))
+        return None
+
+    # print error message if results array is empty
+    if results_count == 0:
+        print(err("had empty results"))
+        return None
+
+    # check that each result has a date key
+    for result in results:
+        result_id = "NONE"
+        if 'id' in result: # check that each result has an id key
+            result_id = result['id']
+        if 'date' not in result:
+            print(err("for ID {0} did not have a corresponding date value".format(result_id)))
+            return None
+
+    # parse and sort all dates in C via numpy's ISO-8601 parser
+    try:
+        parsed_dates = np.array([result['date'] for result in results], dtype='datetime64[us]')
+    except ValueError:
+        print(err("had a wrongly formatted date"))
+        return None
+    parsed_dates.sort()
+
+    # get last_date a satellite image was taken for this location
+    last_date = parsed_dates[-1].item()
+
+    # calculate average time delta; consecutive deltas telescope, so
+    # their sum is just the last date minus the first. The division
+    # stays on datetime.timedelta to keep microsecond rounding
+    # identical to the scalar path.
+    avg_time_delta = (parsed_dates[-1] - parsed_dates[0]).item() / len(results)
 
+    return last_date + avg_time_delta
 
-def flyby(latitude, longitude):
+
+def _next_flyby_time(latitude, longitude, api_key=None):
     """
-    function to predict next time a satellite image will be taken using NASA public HTTP API
+    helper to fetch (with caching) and validate a location's payload
+
+    Errors are printed as they occur; every message carries the
+    coordinates, so this is safe to call from worker threads.
 
     :param latitude: Latitude of location
     :param longitude: Longitude of location
-    :return: void
+    :param api_key: NASA API key; defaults to the API_KEY environment variable
+    :return: Predicted datetime, or None on any failure
     """
-    API_KEY = os.environ.get("API_KEY")
-    count = 0
-    avg_time_delta = 0
-    date_format = "%Y-%m-%dT%H:%M:%S"
+    API_KEY = api_key if api_key is not None else os.environ.get("API_KEY", "DEMO_KEY")
     exceptMsg = "Attempted to calculate next flyby picture for coordinates ({0}, {1})".format(latitude, longitude)
+    data_url = ASSETS_URL
+
+    def _err(detail):
+        # error strings are only built on the cold path, when printed
+        return exceptMsg + "\nHTTP GET request for " + data_url + " " + detail
+
+    try: # check for use of floating points values for latitude and longitude
+        latitude_val = float(latitude)
+        longitude_val = float(longitude)
+    except (TypeError, ValueError):
+        print("Both latitude and longitude values must be floats.")
+        return
 
     try:
-        try: # check for use of floating points values for latitude and longitude
-            latitude_val = float(latitude)
-            longitude_val = float(longitude)
-        except e as FloatException:
-            print("Both latitude and longitude values must be floats.")
-
-        # make HTTP GET request to NASA API
-        data_url = 'https://api.nasa.gov/planetary/earth/assets?lon=' + str(longitude_val) + '&lat=' + str(latitude_val) + '&api_key=' + API_KEY
-        data = requests.get(data_url)
-
-        json_data = {}
-        try:
-            json_data = data.json() # check that JSON data is in HTTP response
-        except Exception as JSONException:
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " did not return JSON data.")
-            return
-
-        if 'count' not in json_data: # check that the JSON data has a count key
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " did not contain 'count' key in JSON")
-            return
-
-        try:
-            count = int(json_data['count'])
-        except: # check that count key in JSON data is an integer
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " did not contain an integer for 'count' value in JSON")
-            return
-
-        if count == 0: # print error message if count is 0
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " had 0 count in JSON payload, could not calculate avg_time_delta")
-            return
-
-        # print error message if no results array found in JSON
-        if 'results' not in json_data:
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " did not contain 'results' key in JSON")
-
-
-        results = json_data['results']
-        results_count = len(results)
-        if results_count != count: # check that number of results match the count in JSON payload
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " count of {0}, did not match number of results {1}".format(count, results_count))
-            return
-
-        # print error message if results array is empty
-        if results_count == 0:
-            print(exceptMsg + "\nHTTP GET request for " + data_url + " had empty results")
-            return
-
-        # sort results by date key
-        sorted_results = sorted(results, key=lambda k: k['date'])
-
-        list_of_deltas = []
-
-        # get last_date a satellite image was taken for this location
-        last_result = sorted_results[-1]
-        last_date = datetime.strptime(last_result['date'], date_format)
-
-        # loop through results and calculate time deltas
-        for index, result in enumerate(sorted_results):
-            if index > 0:
-                result_id = "NONE"
-                if 'id' in result: # check that each result has an id key
-                    result_id = result['id']
-                if 'date' not in result: # check that each result has a date key
-                    print(exceptMsg + "\nHTTP GET request for " + data_url + " for ID {0} did not have a corresponding date value".format(result_id))
-                    return
-
-                # calculate deltas and add to list_of_deltas
-                try:
-                    current_datetime = datetime.strptime(result['date'], date_format)
-                    previous_result = sorted_results[index - 1]
-                    previous_datetime = datetime.strptime(previous_result['date'], date_format)
-                    time_delta = (current_datetime - previous_datetime)
-                    list_of_deltas.append(time_delta)
-                except ValueError:
-                    print(exceptMsg + "\nHTTP GET request for " + data_url + " for ID {0} had a wrongly formatted date")
-
-        # calculate average time delta
-        avg_time_delta = sum(list_of_deltas, timedelta()) / len(results)
+        # keyed on the API key too: different keys can see different
+        # payloads (quotas, error bodies), so they must not share entries
+        cache_key = (round(latitude_val, 6), round(longitude_val, 6), API_KEY)
 
-        # print next time a satellite image will be taken at this location
-        print ("Next time: " + str(last_date + avg_time_delta))
+        json_data = None
+        from_mem = False
+        cached = _MEM_CACHE.get(cache_key)
+        if cached is not None and time.monotonic() - cached[0] < _MEM_CACHE_TTL:
+            json_data = cached[1]
+            from_mem = True
+
+        if json_data is None:
+            json_data = _get_cache().get(cache_key)
+
+        fetched = False
+        if json_data is None:
+            # cache miss: make HTTP GET request to NASA API
+            import orjson
+            data = _get_session().get(ASSETS_URL, params={'lon': longitude_val, 'lat': latitude_val, 'api_key': API_KEY})
+            data_url = data.url # full URL with query string, for error messages
+
+            if not data.ok: # check that the HTTP request succeeded
+                print(_err("returned HTTP status {0}".format(data.status_code)))
+                return
+
+            try:
+                json_data = orjson.loads(data.content) # check that JSON data is in HTTP response
+            except Exception as JSONException:
+                print(_err("did not return JSON data."))
+                return
+
+            fetched = True
+
+        next_time = _compute_next_time(json_data, _err)
+        if next_time is None:
+            return None
+
+        # cache only payloads that passed validation, so a transient
+        # error body (e.g. an OVER_RATE_LIMIT response) cannot poison
+        # this coordinate for the full 24-hour TTL
+        if fetched:
+            _get_cache().set(cache_key, json_data, expire=_CACHE_TTL)
+
+        # same rule in memory; a hit keeps its original timestamp so the
+        # 30-second TTL cannot slide under frequent polling
+        if not from_mem:
+            _MEM_CACHE[cache_key] = (time.monotonic(), json_data)
+
+        return next_time
 
 
     except Exception as e:
-        print(exceptMsg + "\nHTTP GET request for " + data_url + " failed.")
+        print(_err("failed."))
         traceback.print_exc()
+        return None
 
 
-def testLocation(location, expectedStr):
+def flyby(latitude, longitude, api_key=None):
     """
-    function to test location against expected next time
+    function to predict next time a satellite image will be taken using NASA public HTTP API
 
-    :param location: Location list as  [lat, long]
-    :param expectedStr: Expected string for next datetime
+    :param latitude: Latitude of location
+    :param longitude: Longitude of location
+    :param api_key: NASA API key; defaults to the API_KEY environment variable
     :return: void
     """
-    capturedOutput = StringIO.StringIO()
-    print("\nTESTING LATITUDE, LONGITUDE ({0}, {1})".format(location[0], location[1]))
-    sys.stdout = capturedOutput
-    flyby(location[0], location[1])
-    sys.stdout = sys.__stdout__
-    next_time = str(capturedOutput.getvalue().strip())
-    assert next_time == expectedStr
+    next_time = _next_flyby_time(latitude, longitude, api_key)
+    if next_time is not None:
+        # print next time a satellite image will be taken at this location
+        print ("Next time: " + str(next_time))
+
 
-# Unit tests
-class FlybyTest(unittest.TestCase):
-    def test(self):
-        grand_canyon_loc = [36.098592, -112.097796]
-        testLocation(grand_canyon_loc, "Next time: 2017-05-12 09:52:17.638297")
+def flyby_many(coordinates, max_workers=8):
+    """
+    function to predict next image times for several locations, fetching concurrently
 
-        niagara_falls_loc = [43.078154, -79.075891]
-        testLocation(niagara_falls_loc, "Next time: 2017-05-11 14:20:07.149253")
+    The NASA API has no batch endpoint, so the GETs are fanned out over
+    the shared pooled session; N sequential round trips collapse to
+    roughly one round trip of critical path. Predictions are printed in
+    input order, labelled with their coordinates.
 
-        four_corners_monument_loc = [36.998979, -109.045183]
-        testLocation(four_corners_monument_loc, "Next time: 2017-05-04 05:09:59.609665")
+    :param coordinates: List of (latitude, longitude) pairs
+    :param max_workers: Maximum number of concurrent requests
+    :return: void
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_next_flyby_time, latitude, longitude) for latitude, longitude in coordinates]
+        for (latitude, longitude), future in zip(coordinates, futures):
+            next_time = future.result()
+            if next_time is not None:
+                print("({0}, {1}) next time: {2}".format(latitude, longitude, next_time))
 
-        medsender_hq_loc = [40.720583, -74.001472]
-        testLocation(medsender_hq_loc, "Next time: 2017-04-28 06:51:59.453947")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculate next time a satellite image will be taken given latitude and longitude')
@@ -160,17 +255,19 @@ if __name__ == "__main__":
     parser.add_argument('-u', '--unittest', help='Run unit tests', action='store_true')
     args = parser.parse_args()
 
-    # load environment variables (API_KEY) from .env file
-    load_dotenv(find_dotenv())
-
     # run unit tests if -u argument passed
     if args.unittest:
+        import unittest
+        from test_flyby import FlybyTest # loads the .env file on import
         print("RUNNING UNIT TESTS...")
         runner = unittest.TextTestRunner(verbosity=2)
         result = runner.run(unittest.makeSuite(FlybyTest))
     else:
         # check that latitude and longitude arguments have been passed in
         if args.latitude is not None and args.longitude is not None:
+            # load environment variables (API_KEY) from .env file
+            from dotenv import load_dotenv, find_dotenv
+            load_dotenv(find_dotenv())
             flyby(args.latitude, args.longitude)
         else:
             print("USAGE: python flyby.py -lat <LATITUDE> -lon <LONGITUDE>")
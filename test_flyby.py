@@ -0,0 +1,49 @@
+"""
+.. module:: test_flyby.py
+
+   :synopsis: Unit tests for the flyby prediction function
+"""
+import sys
+import unittest
+from io import StringIO
+from dotenv import load_dotenv, find_dotenv
+
+from flyby import flyby
+
+# load environment variables (API_KEY) from .env file
+load_dotenv(find_dotenv())
+
+
+def testLocation(location, expectedStr):
+    """
+    function to test location against expected next time
+
+    :param location: Location list as  [lat, long]
+    :param expectedStr: Expected string for next datetime
+    :return: void
+    """
+    capturedOutput = StringIO()
+    print("\nTESTING LATITUDE, LONGITUDE ({0}, {1})".format(location[0], location[1]))
+    sys.stdout = capturedOutput
+    flyby(location[0], location[1])
+    sys.stdout = sys.__stdout__
+    next_time = str(capturedOutput.getvalue().strip())
+    assert next_time == expectedStr
+
+# Unit tests
+class FlybyTest(unittest.TestCase):
+    def test(self):
+        grand_canyon_loc = [36.098592, -112.097796]
+        testLocation(grand_canyon_loc, "Next time: 2017-05-12 09:52:17.638297")
+
+        niagara_falls_loc = [43.078154, -79.075891]
+        testLocation(niagara_falls_loc, "Next time: 2017-05-11 14:20:07.149253")
+
+        four_corners_monument_loc = [36.998979, -109.045183]
+        testLocation(four_corners_monument_loc, "Next time: 2017-05-04 05:09:59.609665")
+
+        medsender_hq_loc = [40.720583, -74.001472]
+        testLocation(medsender_hq_loc, "Next time: 2017-04-28 06:51:59.453947")
+
+if __name__ == "__main__":
+    unittest.main()